@@ -0,0 +1,23 @@
+"""Ahead-of-time compile kernels.compute into the funding_kernels extension.
+
+Run once per platform (requires numba with numba.pycc):
+
+    python build_kernels.py
+
+main.py imports funding_kernels when it is present and otherwise falls back
+to JIT-compiling (or interpreting) kernels.compute.
+"""
+import os
+
+from numba.pycc import CC
+
+import kernels
+
+cc = CC('funding_kernels')
+cc.output_dir = os.path.dirname(os.path.abspath(__file__))
+# (price, funding_rate, collateral, max_leverage, fee_rate) -> 5 floats
+cc.export('compute', 'UniTuple(f8, 5)(f8, f8, f8, f8, f8)')(kernels.compute)
+
+
+if __name__ == '__main__':
+    cc.compile()
@@ -0,0 +1,15 @@
+"""Numeric core of the trade simulation, kept free of imports so the same
+source can be JIT-compiled by main.py or AOT-compiled by build_kernels.py.
+"""
+
+
+def compute(price, funding_rate, collateral, max_leverage, fee_rate):
+    """Trade math for one coin (all floats in, tuple of floats out)."""
+    # Short (perp) notional; the spot hedge buys the same notional, so both
+    # legs share one size, one token count and one fee rate.
+    short_size_usd = collateral * max_leverage
+    tokens_per_side = short_size_usd / price if price else 0.0
+    total_fees = short_size_usd * (2.0 * fee_rate)
+    expected_funding_profit = short_size_usd * funding_rate
+    net_pnl_1h = expected_funding_profit - total_fees
+    return short_size_usd, tokens_per_side, total_fees, expected_funding_profit, net_pnl_1h
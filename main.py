@@ -1,74 +1,295 @@
 import requests
-import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
 import time
-from datetime import datetime
+from dataclasses import dataclass
+from typing import Optional
+from collections import namedtuple
+import argparse
+import csv
+import json
+import logging
 import os
+import sys
+import tempfile
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # optional; stdlib json is fine, just slower
+    _loads = json.loads
+
+# Trade math: AOT-compiled extension if built (see build_kernels.py), else
+# numba JIT with an on-disk cache, else plain Python.
+try:
+    from funding_kernels import compute as _compute
+except ImportError:
+    import kernels
+    try:
+        from numba import njit
+    except ImportError:
+        _compute = kernels.compute
+    else:
+        _compute = njit(cache=True, fastmath=True)(kernels.compute)
+        # Compile (or load from cache) at import so the first real call is fast
+        _compute(1.0, 0.0, 1.0, 1.0, 0.0)
+
+log = logging.getLogger('funding')
 
 # --- CONFIG ---
 COLLATERAL = 100        # margin on perp ($)
 TAKER_FEE_RATE = 0.00035  # ~0.035% (adjust as needed)
 
+
+@dataclass(frozen=True)
+class Config:
+    """Simulation parameters. fixed_leverage caps each coin's max leverage when set;
+    hold_hours is the holding period used to rank coins (entry fees are paid once).
+    """
+    collateral: float = COLLATERAL
+    fee: float = TAKER_FEE_RATE
+    fixed_leverage: Optional[int] = None
+    hold_hours: float = 24
+
+
+DEFAULT_CONFIG = Config()
+
 # Public Hyperliquid info API
 API_URL = "https://api.hyperliquid.xyz/info"
+# Constant request body, serialized once ({"type": "metaAndAssetCtxs"})
+_REQ_BODY = b'{"type":"metaAndAssetCtxs"}'
 
+# On-disk cache of the metaAndAssetCtxs response (funding changes slowly)
+def _env_int(name, default):
+    """Integer env var; falls back to default when unset or malformed."""
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
 
-def get_top_funding_coins(limit=5):
-    """Fetch top coins by funding (descending) with max leverage info.
-    Returns a pandas.DataFrame with columns: symbol, funding_rate_hourly, price, max_leverage
+
+# Per-user location (not the shared temp dir), since its contents are trusted
+_CACHE_DIR = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+CACHE_FILE = os.environ.get('HL_CACHE', os.path.join(_CACHE_DIR, 'hyperliquid_ctxs.json'))
+CACHE_TTL = max(0, _env_int('HL_CACHE_TTL', 300))  # seconds; 0 disables reuse
+FORCE_REFRESH = os.environ.get('HL_FORCE_REFRESH', '') not in ('', '0')
+
+# One row of get_top_funding_coins' result
+CoinRow = namedtuple('CoinRow', ['symbol', 'funding_rate_hourly', 'price', 'max_leverage'])
+
+
+@dataclass
+class AssetRow:
+    """One parsed universe entry + its asset context."""
+    __slots__ = ('symbol', 'funding', 'price', 'max_leverage')
+    symbol: str
+    funding: float
+    price: float
+    max_leverage: int
+
+
+# Column order of the history CSV (keys of the simulate_trade result)
+FIELDS = (
+    'symbol', 'price', 'max_leverage', 'collateral_usd', 'short_notional_usd',
+    'funding_rate_hourly', 'expected_funding_1h', 'entry_fees', 'net_pnl_1h', 'timestamp',
+)
+
+# Shared session: keeps the TLS connection alive between calls.
+# The info endpoint is read-only, so retrying POSTs is safe.
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=2,
+    pool_maxsize=4,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['POST']),
+        raise_on_status=False,
+    ),
+))
+# Accept-Encoding is left to requests' default (gzip/deflate, plus br/zstd
+# when those decoders are installed); bodies are decompressed transparently.
+SESSION.headers.update({"Content-Type": "application/json"})
+
+
+def _valid_ctxs(data):
+    """True if data has the [{'universe': [...]}, [...]] shape of metaAndAssetCtxs."""
+    return (isinstance(data, list) and len(data) >= 2
+            and isinstance(data[0], dict) and isinstance(data[0].get('universe'), list)
+            and isinstance(data[1], list))
+
+
+def _read_cache():
+    try:
+        with open(CACHE_FILE, 'rb') as f:
+            data = _loads(f.read())
+    except (OSError, ValueError):
+        return None
+    return data if _valid_ctxs(data) else None
+
+
+def _write_cache(content):
+    """Atomically replace CACHE_FILE with content (bytes)."""
+    cache_dir = os.path.dirname(os.path.abspath(CACHE_FILE))
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    # Unique, unpredictable temp name in the same dir so os.replace is atomic
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, prefix='.hl_ctxs.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, CACHE_FILE)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _fetch_ctxs():
+    """Return the metaAndAssetCtxs payload, reusing the on-disk copy while fresh.
+    Falls back to a stale cached copy if the request fails; re-raises otherwise.
     """
-    payload = {"type": "metaAndAssetCtxs"}
-    headers = {"Content-Type": "application/json"}
+    if not FORCE_REFRESH and CACHE_TTL > 0:
+        try:
+            age = time.time() - os.path.getmtime(CACHE_FILE)
+        except OSError:
+            age = None
+        if age is not None and age < CACHE_TTL:
+            data = _read_cache()
+            if data is not None:
+                return data
 
     try:
-        resp = requests.post(API_URL, json=payload, headers=headers, timeout=10)
+        # Content-Type: application/json is set on SESSION
+        resp = SESSION.post(API_URL, data=_REQ_BODY, timeout=10)
         resp.raise_for_status()
-        data = resp.json()
+        # raw.tell() counts bytes read off the wire (before decompression)
+        log.debug("info API: %s bytes on the wire, %d decoded, Content-Encoding=%s",
+                  resp.raw.tell() if resp.raw is not None else resp.headers.get('Content-Length'),
+                  len(resp.content), resp.headers.get('Content-Encoding'))
+        data = _loads(resp.content)
+        if not _valid_ctxs(data):
+            raise ValueError("unexpected metaAndAssetCtxs response shape")
+    except Exception as e:
+        data = _read_cache()
+        if data is None:
+            raise
+        log.warning("API error: %s (using cached response)", e)
+        return data
+
+    # Only validated responses reach the cache
+    try:
+        _write_cache(resp.content)
+    except OSError as e:
+        log.warning("Could not write cache %s: %s", CACHE_FILE, e)
+    return data
+
+
+_INT64_MIN, _INT64_MAX = int(np.iinfo(np.int64).min), int(np.iinfo(np.int64).max)
+
+
+def _parse_asset(asset, ctx):
+    """Parse one universe entry and its context; None if required fields are missing or invalid."""
+    try:
+        # Max leverage: usually in asset metadata; default to 10 if not present
+        max_lev = asset.get('maxLeverage', 10)
+        max_lev = int(max_lev) if isinstance(max_lev, (int, float)) else 10
+        # Leverage is stored in an int64 array; only values beyond its range
+        # (which would otherwise raise on store) are skipped
+        if not _INT64_MIN <= max_lev <= _INT64_MAX:
+            return None
+        return AssetRow(asset['name'], float(ctx['funding']), float(ctx['markPx']), max_lev)
+    except (KeyError, TypeError, ValueError, AttributeError, OverflowError):
+        return None
+
+
+def get_funding_arrays():
+    """Fetch and parse every listed asset.
+    Returns (symbols, funding_rate_hourly, price, max_leverage) NumPy arrays with
+    unparseable rows removed, or None if the API gave nothing usable.
+    """
+    try:
+        data = _fetch_ctxs()
     except Exception as e:
-        print(f"API error: {e}")
-        return pd.DataFrame()
+        log.error("API error: %s", e)
+        return None
 
     try:
         universe = data[0].get('universe', [])
         asset_ctxs = data[1]
+        # zip() stops at the shorter list; assets without a context are skipped
+        n = min(len(universe), len(asset_ctxs))
     except Exception as e:
-        print(f"Unexpected API response format: {e}")
-        return pd.DataFrame()
+        log.error("Unexpected API response format: %s", e)
+        return None
+    if n == 0:
+        return None
 
-    rows = []
-    for i, asset in enumerate(universe):
-        try:
-            name = asset.get('name')
-            funding = float(asset_ctxs[i].get('funding', 0))
-            price = float(asset_ctxs[i].get('markPx', 0))
-            # Max leverage: usually in asset metadata; default to 10 if not present
-            max_lev = asset.get('maxLeverage', 10)
-            if isinstance(max_lev, (int, float)):
-                max_lev = int(max_lev)
-            else:
-                max_lev = 10
-            rows.append({
-                'symbol': name,
-                'funding_rate_hourly': funding,
-                'price': price,
-                'max_leverage': max_lev
-            })
-        except Exception:
+    syms = np.empty(n, dtype=object)
+    fund = np.empty(n, dtype=np.float64)
+    px = np.empty(n, dtype=np.float64)
+    lev = np.empty(n, dtype=np.int64)
+    for i, (asset, ctx) in enumerate(zip(universe, asset_ctxs)):
+        row = _parse_asset(asset, ctx)
+        if row is None:
+            # Mark the row as invalid; it is masked out below
+            fund[i] = np.nan
             continue
+        syms[i] = row.symbol
+        fund[i] = row.funding
+        px[i] = row.price
+        lev[i] = row.max_leverage
+
+    mask = ~np.isnan(fund)
+    if not mask.any():
+        return None
+    return syms[mask], fund[mask], px[mask], lev[mask]
+
+
+def top_rows(arrays, key, limit=5):
+    """Pick the `limit` rows of get_funding_arrays() output with the largest `key`
+    (an array aligned with them), in descending order.
+    Returns a list of CoinRow(symbol, funding_rate_hourly, price, max_leverage)
+    """
+    syms, fund, px, lev = arrays
+    k = min(limit, key.size)
+    if k <= 0:
+        return []
+
+    # Partial selection of the k largest keys, then order just those
+    idx = np.argpartition(-key, k - 1)[:k]
+    idx = idx[np.argsort(-key[idx], kind='stable')]
+    return [CoinRow(*t) for t in zip(syms[idx].tolist(), fund[idx].tolist(),
+                                     px[idx].tolist(), lev[idx].tolist())]
 
-    df = pd.DataFrame(rows)
-    if df.empty:
-        return df
-    df = df.sort_values(by='funding_rate_hourly', ascending=False)
-    return df.head(limit)
+
+def top_funding_coins(arrays, limit=5):
+    """Pick the `limit` highest-funding rows from get_funding_arrays() output."""
+    return top_rows(arrays, arrays[1], limit)
+
+
+def get_top_funding_coins(limit=5):
+    """Fetch top coins by funding (descending) with max leverage info.
+    Returns a list of CoinRow(symbol, funding_rate_hourly, price, max_leverage)
+    """
+    arrays = get_funding_arrays()
+    if arrays is None:
+        return []
+    return top_funding_coins(arrays, limit)
 
 
-def simulate_trade(coin_data):
+def simulate_trade(coin_data, cfg=DEFAULT_CONFIG):
     """Simulate entering a short + spot hedge for one coin.
-    Uses $100 collateral and max leverage for that pair.
+    Uses cfg.collateral and max leverage for that pair (or cfg.fixed_leverage if set).
     Spot hedge is sized to match short notional value.
-    coin_data: pandas.Series or dict with keys: symbol, price, funding_rate_hourly, max_leverage
+    coin_data: CoinRow, pandas.Series or dict with keys: symbol, price, funding_rate_hourly, max_leverage
     """
-    if isinstance(coin_data, pd.Series):
+    if hasattr(coin_data, '_asdict'):
+        coin = coin_data._asdict()
+    elif hasattr(coin_data, 'to_dict'):
         coin = coin_data.to_dict()
     else:
         coin = dict(coin_data)
@@ -77,79 +298,169 @@ def simulate_trade(coin_data):
     price = float(coin.get('price', 0))
     funding_rate = float(coin.get('funding_rate_hourly', 0))
     max_leverage = coin.get('max_leverage', 10)
+    if cfg.fixed_leverage is not None:
+        # Never above what the exchange allows for this coin
+        max_leverage = min(max_leverage, cfg.fixed_leverage)
 
-    print(f"\n--- SIMULATE ENTRY: {symbol} ---")
-    print(f"Price: ${price}")
-    print(f"Max Leverage: {max_leverage}x")
-    print(f"Current funding (hourly): {funding_rate:.6%}")
+    _, tokens, total_fees, expected_funding_profit, net_pnl_1h = _compute(
+        price, funding_rate, float(cfg.collateral), float(max_leverage), float(cfg.fee))
+    # The kernel works in floats; keep the notional in the caller's types
+    # (int collateral * int leverage stays an int, as in the printed/CSV output)
+    short_size_usd = cfg.collateral * max_leverage
+    total_spent = cfg.collateral + short_size_usd  # margin + spot purchase (same notional)
 
-    # 1) Short (Perp) with $100 collateral and max leverage
-    collateral_short = COLLATERAL
-    short_size_usd = collateral_short * max_leverage  # notional short value
-    short_tokens = short_size_usd / price if price else 0
-    fee_short_entry = short_size_usd * TAKER_FEE_RATE
-
-    # 2) Spot buy: hedge with same notional value as short
-    spot_size_usd = short_size_usd
-    spot_tokens = spot_size_usd / price if price else 0
-    fee_spot_entry = spot_size_usd * TAKER_FEE_RATE
-
-    total_spent = collateral_short + spot_size_usd  # $100 margin + spot purchase
-    total_fees = fee_short_entry + fee_spot_entry
-
-    print(f"Open SHORT: ${short_size_usd} (x{max_leverage} on ${collateral_short}) -> {short_tokens:.6f} tokens")
-    print(f"Buy SPOT: ${spot_size_usd} -> {spot_tokens:.6f} tokens")
-    print(f"Total cash outlay: ${total_spent:.2f}")
-    print(f"Entry fees (spot+perp): ${total_fees:.4f}")
-
-    expected_funding_profit = short_size_usd * funding_rate
-    print(f"Expected funding payout per hour: ${expected_funding_profit:.4f}")
-
-    net_pnl_1h = expected_funding_profit - total_fees
-    print(f"P&L after 1 hour (w/ entry fees): ${net_pnl_1h:.4f}")
-
-    if net_pnl_1h < 0:
-        print("⚠️ WARNING: Fees consume first-hour profit; hold longer to be profitable.")
-    else:
-        print("✅ Profit in the first hour (uncommon).")
+    # Skip all report formatting when INFO is disabled (e.g. silent scoring)
+    if log.isEnabledFor(logging.INFO):
+        log.info("\n--- SIMULATE ENTRY: %s ---", symbol)
+        log.info("Price: $%s", price)
+        log.info("Max Leverage: %sx", max_leverage)
+        log.info("Current funding (hourly): %.6f%%", funding_rate * 100)
+        log.info("Open SHORT: $%s (x%s on $%s) -> %.6f tokens",
+                 short_size_usd, max_leverage, cfg.collateral, tokens)
+        log.info("Buy SPOT: $%s -> %.6f tokens", short_size_usd, tokens)
+        log.info("Total cash outlay: $%.2f", total_spent)
+        log.info("Entry fees (spot+perp): $%.4f", total_fees)
+        log.info("Expected funding payout per hour: $%.4f", expected_funding_profit)
+        log.info("P&L after 1 hour (w/ entry fees): $%.4f", net_pnl_1h)
+        if net_pnl_1h < 0:
+            log.info("⚠️ WARNING: Fees consume first-hour profit; hold longer to be profitable.")
+        else:
+            log.info("✅ Profit in the first hour (uncommon).")
 
     # Return dict for logging
     return {
         'symbol': symbol,
         'price': price,
         'max_leverage': max_leverage,
-        'collateral_usd': collateral_short,
+        'collateral_usd': cfg.collateral,
         'short_notional_usd': short_size_usd,
         'funding_rate_hourly': funding_rate,
         'expected_funding_1h': expected_funding_profit,
         'entry_fees': total_fees,
         'net_pnl_1h': net_pnl_1h,
-        'timestamp': datetime.utcnow().isoformat() + 'Z'
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
     }
 
 
-def main():
-    top_coins = get_top_funding_coins()
-    if top_coins.empty:
-        print("No data available from API.")
+def format_table(rows):
+    """Render CoinRows as a right-aligned text table (like DataFrame.to_string(index=False))."""
+    cells = [CoinRow._fields] + [tuple(str(v) for v in row) for row in rows]
+    widths = [max(len(c[i]) for c in cells) for i in range(len(CoinRow._fields))]
+    return '\n'.join(' '.join(c.rjust(w) for c, w in zip(line, widths)) for line in cells)
+
+
+def append_result(out_file, result):
+    """Append one simulate_trade result to out_file, writing the header if the file is new."""
+    with open(out_file, 'a', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')  # match the existing LF-only history.csv
+        if f.tell() == 0:
+            writer.writerow(FIELDS)
+        writer.writerow([result[k] for k in FIELDS])
+
+
+def score_all(fund, lev, cfg=DEFAULT_CONFIG):
+    """Expected net PnL over cfg.hold_hours (funding minus one-time entry fees)
+    for every coin at once, vectorized over arrays of funding/leverage.
+    """
+    if cfg.fixed_leverage is not None:
+        lev = np.minimum(lev, cfg.fixed_leverage)
+    short_size = cfg.collateral * np.asarray(lev, dtype=np.float64)
+    # funding*size*hours - 2*fee*size, factored so the fee is folded into one scalar
+    return short_size * (np.asarray(fund, dtype=np.float64) * cfg.hold_hours - 2.0 * cfg.fee)
+
+
+def main(cfg=DEFAULT_CONFIG):
+    arrays = get_funding_arrays()
+    if arrays is None:
+        log.error("No data available from API.")
         return
 
-    print("Top coins by funding:")
-    print(top_coins[['symbol', 'funding_rate_hourly', 'price', 'max_leverage']].to_string(index=False))
+    # Only a positive rate pays the short. Among those, rank every listed coin
+    # by net PnL over the holding period rather than by raw funding.
+    eligible = arrays[1] > 0
+    if eligible.any():
+        arrays = tuple(a[eligible] for a in arrays)
+        ranked = top_rows(arrays, score_all(arrays[1], arrays[3], cfg))
+        title = f"Top coins by expected net PnL over {cfg.hold_hours:g}h (positive funding only):"
+    else:
+        ranked = top_funding_coins(arrays)
+        title = "No coin has positive funding; top coins by funding:"
+
+    if log.isEnabledFor(logging.INFO):
+        log.info("%s\n%s", title, format_table(ranked))
 
-    best = top_coins.iloc[0]
-    result = simulate_trade(best)
+    best = ranked[0]
+    result = simulate_trade(best, cfg)
 
     # Optional: append results to CSV for history
     out_file = os.environ.get('OUTPUT_CSV', 'history.csv')
-    df = pd.DataFrame([result])
-    header = not os.path.exists(out_file)
-    df.to_csv(out_file, mode='a', header=header, index=False)
-    print(f"Logged result to {out_file}")
+    append_result(out_file, result)
+    log.info("Logged result to %s", out_file)
 
     # This script uses only public data from Hyperliquid's Info API
     # and performs offline simulation / logging. No API keys are required.
 
 
+def main_dynamic_lev():
+    """Run with each coin's max leverage."""
+    main(Config())
+
+
+def main_fixed_lev(leverage=10):
+    """Run with the same leverage for every coin (capped at each coin's max leverage)."""
+    main(Config(fixed_leverage=leverage))
+
+
+def run_forever(interval_s=60, cfg=DEFAULT_CONFIG):
+    """Call main() every interval_s seconds in one process, so the HTTP session,
+    response cache and compiled kernel are reused across runs.
+    """
+    while True:
+        try:
+            main(cfg)
+        except Exception:
+            log.exception("Run failed")
+        time.sleep(interval_s)
+
+
+def _positive_seconds(value):
+    """argparse type for --loop: a float number of seconds > 0."""
+    try:
+        seconds = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid number: {value!r}")
+    if not seconds > 0:  # also rejects nan
+        raise argparse.ArgumentTypeError(f"must be > 0, got {value}")
+    return seconds
+
+
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="Hyperliquid funding short+spot hedge simulator")
+    parser.add_argument('--loop', type=_positive_seconds, metavar='SECONDS',
+                        help="keep running, repeating every SECONDS")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                        format='%(message)s', stream=sys.stdout)
+
+    # FIXED_LEVERAGE=<n> switches to the fixed-leverage mode
+    fixed = os.environ.get('FIXED_LEVERAGE')
+    if fixed:
+        try:
+            fixed = int(fixed)
+        except ValueError:
+            fixed = 0
+        if fixed <= 0:
+            parser.error(f"FIXED_LEVERAGE must be a positive integer, got {os.environ['FIXED_LEVERAGE']!r}")
+    else:
+        fixed = None
+
+    try:
+        if args.loop is not None:
+            run_forever(args.loop, Config(fixed_leverage=fixed))
+        elif fixed:
+            main_fixed_lev(fixed)
+        else:
+            main_dynamic_lev()
+    except KeyboardInterrupt:
+        log.info("Interrupted, exiting.")
+        sys.exit(130)